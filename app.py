@@ -1,13 +1,18 @@
 # app.py
+import math
 import os
-import glob
+import shutil
 import sqlite3
+import subprocess
 import streamlit as st
 import librosa
 import numpy as np
+import soundfile as sf
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from math import gcd
 from pathlib import Path
-import time
+from scipy.signal import resample_poly
 
 # ---------------- CONFIG ----------------
 DB_FILE = "voice_data.db"
@@ -15,68 +20,218 @@ UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 ALLOWED_AUDIO_EXTS = (".wav", ".mp3", ".ogg", ".flac", ".m4a", ".wav")
+# Set lookup on the splitext suffix: one hash probe instead of an endswith
+# check per allowed extension on the hot scanning/extraction paths.
+_EXT_SET = {e.lower() for e in ALLOWED_AUDIO_EXTS}
+
+# Feature-extraction parameters. Bump FEATURE_VERSION whenever these change so
+# cached vectors computed with the old parameters get recomputed.
+TARGET_SR = 16000
+MAX_DURATION = 30.0
+N_MFCC = 20
+FEATURE_VERSION = 5
+
+# Columnar waveform shard: all registered signals concatenated in one file.
+# Samples live in a raw .npy (so numpy can mmap it); offsets/paths in the npz.
+SHARD_SAMPLES_FILE = "waveform_shard.npy"
+SHARD_META_FILE = "waveform_shard_meta.npz"
 
 # ---------------- DB ----------------
+@st.cache_resource(show_spinner=False)
+def get_conn():
+    """Single long-lived connection; Streamlit runs one process, so sharing is safe."""
+    # filename is UNIQUE, so its implicit index already serves the equality
+    # lookups; a larger statement cache avoids re-parsing the hot queries.
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_conn()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS voices
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   name TEXT NOT NULL,
-                  filename TEXT NOT NULL UNIQUE)''')
+                  filename TEXT NOT NULL UNIQUE,
+                  features BLOB,
+                  mtime REAL,
+                  size INTEGER)''')
+    # Migrate databases created before the feature cache existed.
+    existing_cols = {row[1] for row in c.execute("PRAGMA table_info(voices)")}
+    for col, col_type in (("features", "BLOB"), ("mtime", "REAL"), ("size", "INTEGER")):
+        if col not in existing_cols:
+            c.execute(f"ALTER TABLE voices ADD COLUMN {col} {col_type}")
+    c.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    row = c.execute("SELECT value FROM meta WHERE key = 'feature_version'").fetchone()
+    if row is None or row[0] != str(FEATURE_VERSION):
+        # Parameters changed: drop stale vectors so the next sync recomputes them.
+        c.execute("UPDATE voices SET features = NULL, mtime = NULL, size = NULL")
+        c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('feature_version', ?)",
+                  (str(FEATURE_VERSION),))
     conn.commit()
-    conn.close()
 
 init_db()
 
 def save_voice(name, file_path):
     """Insert a voice entry if the file_path is not already registered."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+    conn = get_conn()
     try:
-        c.execute("INSERT OR IGNORE INTO voices (name, filename) VALUES (?, ?)", (name, file_path))
+        conn.execute("INSERT OR IGNORE INTO voices (name, filename) VALUES (?, ?)", (name, file_path))
         conn.commit()
     except Exception:
         pass
-    finally:
-        conn.close()
 
 def get_voices_by_name(name):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT id, name, filename FROM voices WHERE name LIKE ?", (f"%{name}%",))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    c = get_conn().execute("SELECT id, name, filename FROM voices WHERE name LIKE ?", (f"%{name}%",))
+    return c.fetchall()
 
 def get_all_db_rows():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT name, filename FROM voices")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    c = get_conn().execute("SELECT name, filename FROM voices")
+    return c.fetchall()
 
 def file_registered_in_db(file_path):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM voices WHERE filename = ?", (file_path,))
-    found = c.fetchone() is not None
-    conn.close()
-    return found
+    c = get_conn().execute("SELECT 1 FROM voices WHERE filename = ?", (file_path,))
+    return c.fetchone() is not None
+
+# ---------------- FEATURE CACHE ----------------
+# Vectors are stored int8-quantized with one float32 scale per row:
+# blob = scale (4 bytes) + n_mfcc int8 values. Quarter the footprint of
+# float32 and the int8 rows feed an integer dot product at match time.
+def quantize_feature(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    scale = float(np.max(np.abs(vec))) / 127.0
+    if scale == 0.0:
+        scale = 1.0
+    q = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+    return scale, q
+
+def feature_to_blob(vec):
+    scale, q = quantize_feature(vec)
+    return np.float32(scale).tobytes() + q.tobytes()
+
+def blob_to_feature(blob):
+    scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+    q = np.frombuffer(blob, dtype=np.int8, offset=4)
+    return q.astype(np.float32) * scale
+
+def save_feature(file_path, vec, mtime, size):
+    conn = get_conn()
+    conn.execute("UPDATE voices SET features = ?, mtime = ?, size = ? WHERE filename = ?",
+                 (feature_to_blob(vec), mtime, size, file_path))
+    conn.commit()
+
+def get_cached_feature(path):
+    """Return the cached MFCC-mean for path, or None if missing or stale."""
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    c = get_conn().execute("SELECT features, mtime, size FROM voices WHERE filename = ?", (path,))
+    row = c.fetchone()
+    if row and row[0] is not None and row[1] == stat.st_mtime and row[2] == stat.st_size:
+        return blob_to_feature(row[0])
+    return None
+
+def get_or_compute_feature(path):
+    """Return the cached MFCC-mean for path, recomputing only when the file changed."""
+    path = os.path.abspath(path)
+    vec = get_cached_feature(path)
+    if vec is not None:
+        return vec
+    vec = load_mfcc_mean_cached(path)
+    if vec is not None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return vec
+        save_feature(path, vec, stat.st_mtime, stat.st_size)
+    return vec
+
+def get_cached_feature_rows():
+    """Load every cached (filename, feature vector) pair in a single query."""
+    c = get_conn().execute("SELECT filename, features FROM voices WHERE features IS NOT NULL")
+    return [(path, blob_to_feature(blob)) for path, blob in c.fetchall()]
+
+def feature_cache_stamp():
+    """Cheap fingerprint of the cache contents, used to key the pinned matrix."""
+    c = get_conn().execute(
+        "SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(MAX(mtime), 0) "
+        "FROM voices WHERE features IS NOT NULL")
+    return c.fetchone()
+
+@st.cache_resource(show_spinner=False)
+def load_feature_matrix(stamp):
+    """All cached vectors as a pinned (N, n_mfcc) int8 matrix plus per-row scales."""
+    c = get_conn().execute("SELECT filename, features FROM voices WHERE features IS NOT NULL")
+    paths, q_rows, scales = [], [], []
+    for path, blob in c.fetchall():
+        paths.append(path)
+        scales.append(np.frombuffer(blob, dtype=np.float32, count=1)[0])
+        q_rows.append(np.frombuffer(blob, dtype=np.int8, offset=4))
+    if not paths:
+        return [], None, None
+    return paths, np.vstack(q_rows), np.asarray(scales, dtype=np.float32)
+
+@st.cache_resource(show_spinner=False)
+def load_ann_index(stamp):
+    """HNSW index over the dequantized vectors for O(log N) top-K search.
+
+    Returns None when FAISS is absent or the database is small enough that a
+    linear scan is already cheap; the index is rebuilt (and re-cached) only
+    when the feature cache stamp changes.
+    """
+    if faiss is None:
+        return None
+    _, Q, scales = load_feature_matrix(stamp)
+    if Q is None or Q.shape[0] < ANN_MIN_ROWS:
+        return None
+    index = faiss.IndexHNSWFlat(Q.shape[1], 32)
+    index.add(np.ascontiguousarray(Q.astype(np.float32) * scales[:, None]))
+    return index
+
+@st.cache_resource(show_spinner=False)
+def load_feature_matrix_gpu(stamp):
+    """Dequantized float32 copy of the feature matrix, resident on the GPU.
+
+    Returns None when CuPy (or a CUDA device) is unavailable; matching then
+    stays on the CPU int8 path.
+    """
+    if cp is None:
+        return None
+    _, Q, scales = load_feature_matrix(stamp)
+    if Q is None:
+        return None
+    try:
+        return cp.asarray(Q.astype(np.float32) * scales[:, None])
+    except Exception:
+        return None
 
 # ---------------- FILE HELPERS ----------------
-def unique_path(target_path):
-    base = Path(target_path)
-    parent = base.parent
-    stem = base.stem
-    ext = base.suffix
+def unique_path(target_path, existing=None):
+    """Return a collision-free variant of target_path.
+
+    Collisions are resolved against a set of names from one listdir (a hash
+    probe per attempt) rather than a stat syscall per attempt. Callers doing
+    bulk writes can pass their own `existing` set to reuse it across files;
+    chosen names are added to the set.
+    """
+    parent = os.path.dirname(target_path) or "."
+    stem, ext = os.path.splitext(os.path.basename(target_path))
+    if existing is None:
+        try:
+            existing = set(os.listdir(parent))
+        except OSError:
+            existing = set()
+    name = stem + ext
     counter = 1
-    p = base
-    while p.exists():
-        p = parent / f"{stem}_{counter}{ext}"
+    while name in existing:
+        name = f"{stem}_{counter}{ext}"
         counter += 1
-    return str(p)
+    existing.add(name)
+    return os.path.join(parent, name)
 
 def save_uploaded_file(uploaded_file, dest_dir=UPLOAD_DIR):
     safe_name = os.path.basename(uploaded_file.name)
@@ -88,6 +243,8 @@ def save_uploaded_file(uploaded_file, dest_dir=UPLOAD_DIR):
 
 def extract_audio_from_zip(zip_path, dest_dir=UPLOAD_DIR):
     saved = []
+    # One listdir up front; probing the set avoids a stat per name collision.
+    existing = set(os.listdir(dest_dir))
     with zipfile.ZipFile(zip_path, "r") as z:
         for member in z.namelist():
             if member.endswith("/") or member.startswith("__MACOSX/"):
@@ -95,56 +252,270 @@ def extract_audio_from_zip(zip_path, dest_dir=UPLOAD_DIR):
             name = os.path.basename(member)
             if not name:
                 continue
-            lower = name.lower()
-            if any(lower.endswith(ext) for ext in ALLOWED_AUDIO_EXTS):
+            if os.path.splitext(name)[1].lower() in _EXT_SET:
                 try:
-                    data = z.read(member)
-                    dest_path = os.path.join(dest_dir, name)
-                    dest_path = unique_path(dest_path)
-                    with open(dest_path, "wb") as out:
-                        out.write(data)
+                    dest_path = unique_path(os.path.join(dest_dir, name), existing)
+                    # Chunked copy keeps memory at one buffer regardless of
+                    # member size instead of materializing the whole file.
+                    with z.open(member) as src, open(dest_path, "wb") as out:
+                        shutil.copyfileobj(src, out, 1024 * 1024)
                     saved.append(dest_path)
                 except Exception:
                     continue
     return saved
 
+@st.cache_data(ttl=2, show_spinner=False)
 def scan_uploads_for_audio():
+    # One os.walk pass instead of one recursive glob per extension; the short
+    # TTL keeps repeated renders from re-walking an unchanged tree.
     files = []
-    for ext in ALLOWED_AUDIO_EXTS:
-        files += glob.glob(os.path.join(UPLOAD_DIR, f"**/*{ext}"), recursive=True)
-    files = sorted(list({os.path.abspath(f) for f in files}))
-    return files
+    for root, _, names in os.walk(UPLOAD_DIR):
+        for n in names:
+            if os.path.splitext(n)[1].lower() in _EXT_SET:
+                files.append(os.path.abspath(os.path.join(root, n)))
+    return sorted(set(files))
 
 def sync_uploads_to_db():
     files = scan_uploads_for_audio()
-    count = 0
+    conn = get_conn()
+    # One query into a set instead of one indexed probe per file.
+    registered = {row[0] for row in conn.execute("SELECT filename FROM voices")}
+    new_rows = [(Path(f).stem, f) for f in files if f not in registered]
+    if new_rows:
+        conn.executemany("INSERT OR IGNORE INTO voices (name, filename) VALUES (?, ?)", new_rows)
+        conn.commit()
+    count = len(new_rows)
+    # Eagerly warm the feature cache so matching never has to decode candidates.
+    # Extraction is embarrassingly parallel, so fan uncached files out over all cores.
+    cached_meta = {row[0]: (row[1], row[2]) for row in conn.execute(
+        "SELECT filename, mtime, size FROM voices WHERE features IS NOT NULL")}
+    pending = []
     for f in files:
-        if not file_registered_in_db(f):
-            name = Path(f).stem
-            save_voice(name, f)
-            count += 1
+        try:
+            stat = os.stat(f)
+        except OSError:
+            continue
+        if cached_meta.get(f) != (stat.st_mtime, stat.st_size):
+            pending.append(f)
+    if not pending:
+        return count
+    if len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            feats = list(ex.map(load_mfcc_mean, pending, chunksize=8))
+    else:
+        feats = [load_mfcc_mean(pending[0])]
+    updates = []
+    for f, vec in zip(pending, feats):
+        if vec is None:
+            continue
+        try:
+            stat = os.stat(f)
+        except OSError:
+            continue
+        updates.append((feature_to_blob(vec), stat.st_mtime, stat.st_size, f))
+    if updates:
+        conn.executemany("UPDATE voices SET features = ?, mtime = ?, size = ? WHERE filename = ?", updates)
+        conn.commit()
     return count
 
+@st.cache_data(ttl=30, show_spinner=False)
+def _maybe_sync(dir_mtime):
+    # Streamlit reruns the whole script on every widget interaction; keying on
+    # the folder mtime (with a TTL for changes deeper in the tree) means the
+    # full scan-and-sync only runs when uploads/ actually changed.
+    return sync_uploads_to_db()
+
 # ---------------- AUDIO / COMPARISON ----------------
-def load_mfcc_mean(path, n_mfcc=20):
+_SOUNDFILE_EXTS = {".wav", ".flac", ".ogg"}
+
+# Optional GPU offload for match scoring on very large databases.
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+# Optional approximate-NN index; linear scan stays the default for small N.
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+ANN_MIN_ROWS = 5000
+
+# librosa already depends on numba, but keep a plain-numpy fallback anyway.
+try:
+    from numba import njit, types
+
+    @njit(cache=True, fastmath=True)
+    def _l2_dist(a, b):
+        s = 0.0
+        for i in range(a.shape[0]):
+            d = a[i] - b[i]
+            s += d * d
+        return math.sqrt(s)
+
+    # Shape-specialized variant: the explicit signature compiles eagerly (and
+    # caches to disk), and the fixed trip count lets the compiler unroll the
+    # loop into straight SIMD code for the exact N_MFCC-element vectors.
+    @njit(types.float32(types.float32[::1], types.float32[::1]),
+          cache=True, fastmath=True, boundscheck=False)
+    def _dist_fixed(a, b):
+        s = np.float32(0.0)
+        for i in range(N_MFCC):
+            d = a[i] - b[i]
+            s += d * d
+        return np.sqrt(s)
+except ImportError:
+    _dist_fixed = None
+
+    def _l2_dist(a, b):
+        return float(np.linalg.norm(a - b))
+
+def decode_audio(path, sr=None, duration=None):
+    """Decode path to a mono float32 signal without going through audioread.
+
+    wav/flac/ogg are read directly with soundfile; mp3/m4a are decoded by
+    ffmpeg straight into a raw float32 pipe. librosa.load remains the
+    fallback for anything else. Resampling goes through
+    scipy.signal.resample_poly, which is much cheaper than resampy.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _SOUNDFILE_EXTS:
+        with sf.SoundFile(path) as snd:
+            file_sr = snd.samplerate
+            frames = -1 if duration is None else int(duration * file_sr)
+            y = snd.read(frames=frames, dtype="float32", always_2d=False)
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        if sr is not None and file_sr != sr:
+            g = gcd(int(sr), int(file_sr))
+            y = resample_poly(y, sr // g, file_sr // g).astype(np.float32, copy=False)
+            file_sr = sr
+        return y, file_sr
+    target_sr = sr or 22050
     try:
-        y, sr = librosa.load(path, sr=None, mono=True)
-        if y.size < 10:
-            return None
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc)
-        mfcc_mean = np.mean(mfcc, axis=1)
-        return mfcc_mean
+        cmd = ["ffmpeg", "-v", "quiet", "-i", path]
+        if duration is not None:
+            cmd += ["-t", str(duration)]
+        cmd += ["-f", "f32le", "-ac", "1", "-ar", str(target_sr), "pipe:1"]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        y = np.frombuffer(proc.stdout, dtype=np.float32)
+        if y.size:
+            return y, target_sr
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return librosa.load(path, sr=sr, mono=True, duration=duration)
+
+def mfcc_mean_from_signal(y, sr, n_mfcc=N_MFCC):
+    """Trimmed, unit-normalized MFCC mean of an already-decoded mono signal."""
+    # Stay float32 end to end: half the bandwidth and twice the SIMD
+    # lanes versus letting anything promote to float64.
+    y = y.astype(np.float32, copy=False)
+    # Real-world recordings are often mostly silence; trimming it shrinks the
+    # STFT window proportionally. Fall back to the raw signal when the clip is
+    # quiet enough that the trim removes everything.
+    yt, _ = librosa.effects.trim(y, top_db=25, frame_length=1024, hop_length=256)
+    y = yt if yt.size >= 10 else y
+    if y.size < 10:
+        return None
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc, n_fft=512, hop_length=256)
+    mfcc_mean = mfcc.mean(axis=1, dtype=np.float32)
+    # Unit-normalize so matching reduces to a dot product:
+    # ||a - b||^2 = 2 - 2 a.b for unit vectors.
+    norm = float(np.linalg.norm(mfcc_mean))
+    if norm == 0.0 or not np.isfinite(norm):
+        return None
+    return (mfcc_mean / norm).astype(np.float32)
+
+def load_mfcc_mean(path, n_mfcc=N_MFCC):
+    try:
+        # 16 kHz mono capped at 30 s keeps plenty of signal for a pooled mean
+        # while cutting the STFT work by ~3x versus native 44.1/48 kHz.
+        y, sr = decode_audio(path, sr=TARGET_SR, duration=MAX_DURATION)
+        return mfcc_mean_from_signal(y, sr, n_mfcc=n_mfcc)
     except Exception:
         return None
 
+# ---------------- WAVEFORM SHARD (columnar batch storage) ----------------
+def build_waveform_shard():
+    """Pack every registered file's 16 kHz signal into one columnar shard.
+
+    Samples are concatenated float16 in a raw .npy next to an npz holding the
+    per-file offsets and paths, so batch re-extraction (e.g. after changing
+    feature parameters) reads one file sequentially instead of reopening and
+    redecoding thousands of originals.
+    """
+    chunks, offsets, paths = [], [0], []
+    total = 0
+    for _, path in get_all_db_rows():
+        try:
+            y, _ = decode_audio(path, sr=TARGET_SR, duration=MAX_DURATION)
+        except Exception:
+            continue
+        if y.size < 10:
+            continue
+        chunks.append(y.astype(np.float16))
+        total += y.size
+        offsets.append(total)
+        paths.append(os.path.abspath(path))
+    if not chunks:
+        return 0
+    np.save(SHARD_SAMPLES_FILE, np.concatenate(chunks))
+    np.savez(SHARD_META_FILE,
+             offsets=np.asarray(offsets, dtype=np.int64),
+             paths=np.asarray(paths),
+             sr=np.int64(TARGET_SR))
+    return len(paths)
+
+def reextract_features_from_shard():
+    """Recompute every cached vector from the shard, no original files needed."""
+    if not (os.path.exists(SHARD_SAMPLES_FILE) and os.path.exists(SHARD_META_FILE)):
+        return 0
+    samples = np.load(SHARD_SAMPLES_FILE, mmap_mode="r")
+    meta = np.load(SHARD_META_FILE)
+    offsets, paths, sr = meta["offsets"], meta["paths"], int(meta["sr"])
+    updates = []
+    for i, path in enumerate(paths):
+        y = np.asarray(samples[offsets[i]:offsets[i + 1]], dtype=np.float32)
+        vec = mfcc_mean_from_signal(y, sr)
+        if vec is None:
+            continue
+        try:
+            stat = os.stat(path)
+            mtime, size = stat.st_mtime, stat.st_size
+        except OSError:
+            mtime, size = None, None
+        updates.append((feature_to_blob(vec), mtime, size, str(path)))
+    if updates:
+        conn = get_conn()
+        conn.executemany("UPDATE voices SET features = ?, mtime = ?, size = ? WHERE filename = ?", updates)
+        conn.commit()
+    return len(updates)
+
+@st.cache_data(show_spinner=False, max_entries=2048)
+def _load_mfcc_memo(path, mtime, size):
+    return load_mfcc_mean(path)
+
+def load_mfcc_mean_cached(path):
+    """In-memory memoized load_mfcc_mean; (mtime, size) in the key invalidates
+    stale entries when a file changes. Complements the on-disk blob cache."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _load_mfcc_memo(path, stat.st_mtime, stat.st_size)
+
 def compare_voice(query_path, candidate_path):
-    v1 = load_mfcc_mean(query_path)
-    v2 = load_mfcc_mean(candidate_path)
+    v1 = load_mfcc_mean_cached(query_path)
+    v2 = get_or_compute_feature(candidate_path)
     if v1 is None or v2 is None:
         return None
     try:
-        dist = float(np.linalg.norm(v1 - v2))
-        return dist
+        a = np.ascontiguousarray(v1, dtype=np.float32)
+        b = np.ascontiguousarray(v2, dtype=np.float32)
+        if _dist_fixed is not None and a.shape[0] == N_MFCC == b.shape[0]:
+            return float(_dist_fixed(a, b))
+        return float(_l2_dist(a, b))
     except Exception:
         return None
 
@@ -153,8 +524,7 @@ st.set_page_config(page_title="Voice Data App", layout="wide")
 st.title("🎙️ Voice Data App — Upload folders & Match against stored data")
 
 with st.spinner("Syncing uploads folder with database..."):
-    new_count = sync_uploads_to_db()
-    time.sleep(0.3)
+    new_count = _maybe_sync(os.path.getmtime(UPLOAD_DIR))
 
 menu = ["Add Data", "Find Data", "Manage"]
 choice = st.sidebar.selectbox("Menu", menu)
@@ -186,7 +556,7 @@ if choice == "Add Data":
 
             registered = 0
             for path in saved_all:
-                if os.path.isfile(path) and any(path.lower().endswith(ext) for ext in ALLOWED_AUDIO_EXTS):
+                if os.path.isfile(path) and os.path.splitext(path)[1].lower() in _EXT_SET:
                     name = Path(path).stem
                     save_voice(name, os.path.abspath(path))
                     registered += 1
@@ -221,8 +591,9 @@ elif choice == "Find Data":
                     for idx, name, filepath in rows:
                         st.write(f"**{name}** — `{filepath}`")
                         try:
-                            with open(filepath, "rb") as f:
-                                st.audio(f.read())
+                            # Pass the path so Streamlit streams the file instead
+                            # of holding the whole thing in memory.
+                            st.audio(filepath)
                         except Exception:
                             st.write("Could not play this file.")
 
@@ -231,7 +602,7 @@ elif choice == "Find Data":
         uploaded_voice = st.file_uploader("Upload Query Voice File", type=list(x.strip(".") for x in ALLOWED_AUDIO_EXTS))
         match_mode = st.radio("Match Against", ["Database", "Uploads folder", "Both"], index=2)
         top_k = st.slider("Show top K matches", 1, 10, 3)
-        threshold = st.number_input("Threshold (lower = stricter)", value=100.0, step=1.0)
+        threshold = st.number_input("Threshold (0-2, lower = stricter)", value=2.0, step=0.05)
 
         if st.button("Match"):
             if not uploaded_voice:
@@ -252,21 +623,74 @@ elif choice == "Find Data":
                 if not candidates:
                     st.warning("No candidate files found.")
                 else:
-                    results = []
+                    query_vec = load_mfcc_mean_cached(query_path)
+                    if query_vec is None:
+                        st.error("Could not read the query audio file.")
+                        candidates = []
+                    stamp = feature_cache_stamp()
+                    all_paths, Q_all, scales_all = load_feature_matrix(stamp)
+                    row_of = {p: i for i, p in enumerate(all_paths)}
+                    names, paths, q_rows, row_scales = [], [], [], []
+                    cache_idx, used_fallback = [], False
                     for name, path in candidates:
-                        dist = compare_voice(query_path, path)
-                        if dist is not None:
-                            results.append((name, path, dist))
-
-                    results.sort(key=lambda x: x[2])
-                    if results:
-                        accepted = [r for r in results if r[2] <= threshold]
-                        shown = accepted[:top_k] if accepted else results[:top_k]
+                        i = row_of.get(os.path.abspath(path))
+                        if i is not None:
+                            scale, q_row = scales_all[i], Q_all[i]
+                            cache_idx.append(i)
+                        else:
+                            vec = get_or_compute_feature(path)
+                            if vec is None:
+                                continue
+                            scale, q_row = quantize_feature(vec)
+                            used_fallback = True
+                        names.append(name)
+                        paths.append(path)
+                        q_rows.append(q_row)
+                        row_scales.append(scale)
+
+                    if q_rows:
+                        best = None
+                        # ANN path: when every candidate is a cached row, ask the
+                        # HNSW index for the top K instead of scanning all rows.
+                        ann = load_ann_index(stamp)
+                        if ann is not None and not used_fallback and len(q_rows) == len(all_paths):
+                            k = min(top_k, len(q_rows))
+                            D, I = ann.search(query_vec.astype(np.float32)[None], k)
+                            pos_of_row = {r: j for j, r in enumerate(cache_idx)}
+                            best = [(names[pos_of_row[r]], paths[pos_of_row[r]],
+                                     float(np.sqrt(max(d, 0.0))))
+                                    for r, d in zip(I[0], D[0]) if r in pos_of_row]
+                        if best is None:
+                            scores = None
+                            # GPU path: the full matrix stays resident, so only the
+                            # query vector and row indices cross the PCIe bus.
+                            if cp is not None and not used_fallback:
+                                F_gpu = load_feature_matrix_gpu(stamp)
+                                if F_gpu is not None:
+                                    sel = cp.asarray(np.asarray(cache_idx, dtype=np.int64))
+                                    q_gpu = cp.asarray(query_vec.astype(np.float32))
+                                    scores = cp.asnumpy(F_gpu[sel] @ q_gpu)
+                            if scores is None:
+                                # Vectors are unit-normalized, so all scores come from
+                                # a single int8 matrix-vector product rescaled per row.
+                                Q = np.vstack(q_rows)
+                                q_scale, q_int8 = quantize_feature(query_vec)
+                                acc = np.einsum("ij,j->i", Q, q_int8, dtype=np.int32)
+                                scores = acc.astype(np.float32) * (
+                                    np.asarray(row_scales, dtype=np.float32) * np.float32(q_scale))
+                            dists = np.sqrt(np.maximum(2.0 - 2.0 * scores, 0.0))
+                            if dists.size > top_k:
+                                keep = np.argpartition(dists, top_k)[:top_k]
+                            else:
+                                keep = np.arange(dists.size)
+                            keep = keep[np.argsort(dists[keep])]
+                            best = [(names[i], paths[i], float(dists[i])) for i in keep]
+                        accepted = [r for r in best if r[2] <= threshold]
+                        shown = accepted if accepted else best
                         for idx, (name, path, dist) in enumerate(shown, start=1):
                             st.markdown(f"**#{idx} — {name}**\n`{path}`\nDistance = **{dist:.2f}**")
                             try:
-                                with open(path, "rb") as f:
-                                    st.audio(f.read())
+                                st.audio(path)
                             except Exception:
                                 st.write("Could not play this file.")
                     else:
@@ -290,12 +714,20 @@ elif choice == "Manage":
         st.success(f"Added {added} new files to DB.")
         st.rerun()
 
+    if st.button("Build waveform shard"):
+        with st.spinner("Packing registered audio into a columnar shard..."):
+            packed = build_waveform_shard()
+        st.success(f"Packed {packed} files into `{SHARD_SAMPLES_FILE}`.")
+
+    if st.button("Re-extract features from shard"):
+        with st.spinner("Recomputing features from the shard..."):
+            redone = reextract_features_from_shard()
+        st.success(f"Recomputed {redone} feature vectors from the shard.")
+
     if st.button("Clear DB (danger)"):
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("DELETE FROM voices")
+        conn = get_conn()
+        conn.execute("DELETE FROM voices")
         conn.commit()
-        conn.close()
         st.success("DB cleared.")
         st.rerun()
 